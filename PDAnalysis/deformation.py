@@ -4,7 +4,7 @@ import numpy as np
 import pandas as pd
 
 from .protein import Protein, AverageProtein
-from .utils import rotate_points, get_shared_indices, get_mutation_position
+from .utils import rotate_points, rotate_point_sets, get_mutation_position
 
 
 class Deformation:
@@ -130,7 +130,7 @@ class Deformation:
         
         self.default_method = ["strain"]
         self.all_methods = ["mut_dist", "strain", "shear", "non_affine", "ldd", "lddt", "neighborhood_dist", "rmsd"]
-        self.lddt_cutoffs = kwargs.get("lddt_cutoffs", [0.5, 1, 2, 4])
+        self.lddt_cutoffs = np.asarray(kwargs.get("lddt_cutoffs", [0.5, 1, 2, 4]))
         self.method = kwargs.get('method', self.default_method.copy())
         self.neigh_cut = kwargs.get('neigh_cut', 13.0)
 
@@ -383,13 +383,23 @@ class Deformation:
 
     def _get_shared_indices(self):
         """Get shared indices between two neighborhoods"""
-        self.shared_indices = []
-        for i in range(self.prot1.seq_len):
-            # If no data for residue, shared indices is empty
-            if (not len(self.prot1.neigh_idx[i])) | (not len(self.prot2.neigh_idx[i])):
-                self.shared_indices.append(([], []))
-            else:
-                self.shared_indices.append(get_shared_indices(self.prot1.neigh_idx[i], self.prot2.neigh_idx[i]))
+        # Neighbors that are shared by both proteins
+        shared = self.prot1.neigh_mask & self.prot2.neigh_mask
+        count = np.sum(shared, axis=1)
+        self.shared_ptr = np.concatenate([[0], np.cumsum(count)])
+
+        # Neighbors are stored in the same order as the mask, so the positions
+        # of shared neighbors in the flat neighbor arrays can be read off the mask
+        self.shared_flat = [np.flatnonzero(shared[prot.neigh_mask]) for prot in self.proteins]
+
+        # Positions of shared neighbors within each residue's neighbor list
+        i1, i2 = [np.split(flat - np.repeat(prot.neigh_ptr[:-1], count), self.shared_ptr[1:-1])
+                  for flat, prot in zip(self.shared_flat, self.proteins)]
+        self.shared_indices = list(zip(i1, i2))
+
+        # Gather the tensors of shared neighbors for all residues at once;
+        # these are reused by every deformation method
+        self.shared_tensor = [prot.neigh_tensor_flat[flat] for flat, prot in zip(self.shared_flat, self.proteins)]
 
 
     # Calculate distance from closest mutation
@@ -405,8 +415,12 @@ class Deformation:
         mut_dist2 = self.prot2.dist_mat[:,self.sub_pos]
 
         # Average the distance across both structures,
-        # and get the minimum distance per residue to a mutated position
-        self.mut_dist = np.nanmin(0.5 * (mut_dist1 + mut_dist2), axis=1)
+        # and get the minimum distance per residue to a mutated position;
+        # missing distances are ignored, unless all distances are missing
+        mut_dist = 0.5 * (mut_dist1 + mut_dist2)
+        mut_dist[np.isnan(mut_dist)] = np.inf
+        self.mut_dist = mut_dist.min(axis=1)
+        self.mut_dist[np.isinf(self.mut_dist)] = np.nan
 
 
     def _calculate_deformation(self, deformation_method):
@@ -417,19 +431,46 @@ class Deformation:
             self._get_shared_indices()
 
         kwargs = {arg: getattr(self, arg) for arg in ["force_relative", "force_norm", "force_absolute", "force_nonorm"]}
-        for i in range(self.prot1.seq_len):
-            # Get shared indices
-            i1, i2 = self.shared_indices[i]
 
+        # Each residue only needs a contiguous slice of the shared tensors
+        tensor1, tensor2 = self.shared_tensor
+        bounds = zip(self.shared_ptr[:-1].tolist(), self.shared_ptr[1:].tolist())
+        for i, (start, end) in enumerate(bounds):
             # If no shared indices, leave np.nan
-            if not len(i1):
+            if start == end:
                 continue
 
-            deformation[i] = deformation_method(self.prot1.neigh_tensor[i][i1], self.prot2.neigh_tensor[i][i2], **kwargs)
+            deformation[i] = deformation_method(tensor1[start:end], tensor2[start:end], **kwargs)
 
         return deformation
 
 
+    def _get_rotated_shared_tensor(self):
+        """Rotate the shared neighborhood tensors of protein_2
+        to match those of protein_1, for all residues at once"""
+        if not hasattr(self, "shared_indices"):
+            self._get_shared_indices()
+
+        # Residues with shared neighbors; their neighborhoods are stored
+        # as consecutive blocks of rows
+        tensor1, tensor2 = self.shared_tensor
+        start = self.shared_ptr[np.flatnonzero(np.diff(self.shared_ptr))]
+        if len(start):
+            self.rotated_tensor = rotate_point_sets(tensor2, tensor1, start)
+        else:
+            self.rotated_tensor = tensor2.copy()
+
+
+    def _sum_over_shared_neighbors(self, values):
+        """Sum per-neighbor values over the shared neighbors of each residue"""
+        total = np.zeros(self.prot1.seq_len, float) * np.nan
+        # If no shared indices, leave np.nan
+        res = np.flatnonzero(np.diff(self.shared_ptr))
+        if len(res):
+            total[res] = np.add.reduceat(values, self.shared_ptr[res])
+        return total
+
+
     def _calculate_lddt_residue(self, neigh_tensor1, neigh_tensor2, **kwargs):
         """Calculate LDDT given a pair of neighborhood tensors"""
         # Get local distance vectors
@@ -439,7 +480,8 @@ class Deformation:
         # Get local distance difference vector
         dv = v2 - v1
 
-        return np.sum([np.sum(dv<=cut) for cut in self.lddt_cutoffs]) / (len(self.lddt_cutoffs) * len(dv))
+        # Compare against all thresholds at once
+        return np.count_nonzero(dv[:,None] <= self.lddt_cutoffs) / (len(self.lddt_cutoffs) * len(dv))
 
     def calculate_lddt(self):
         """Calculate LDDT"""
@@ -462,7 +504,7 @@ class Deformation:
         # Calculate local distance difference 
         if kwargs["force_norm"]:
             # Normalize LDD by number of neighbors
-            return np.linalg.norm(dv) / len(i1)
+            return np.linalg.norm(dv) / len(dv)
         else:
             return np.linalg.norm(dv)
 
@@ -472,30 +514,32 @@ class Deformation:
         self.ldd = self._calculate_deformation(self._calculate_ldd_residue)
 
 
-    def _calculate_nd_residue(self, neigh_tensor1, neigh_tensor2, **kwargs):
-        """Calculate neighborhood distance given a pair of neighborhood tensors"""
-        # Rotate neighbourhood tensor and calculate Euclidean distance
-        nd = np.linalg.norm(rotate_points(neigh_tensor2, neigh_tensor1) - neigh_tensor1)
-        if kwargs["force_norm"]:
-            return nd / len(i1)
-        else:
-            return nd
-
-
     def calculate_neighborhood_dist(self):
         """Calculate neighborhood_distance"""
-        self.neighbor_distance = self._calculate_deformation(self._calculate_nd_residue)
+        if not hasattr(self, "rotated_tensor"):
+            self._get_rotated_shared_tensor()
+
+        # Euclidean distance between each pair of rotated neighbourhood tensors
+        sd = np.sum((self.rotated_tensor - self.shared_tensor[0])**2, axis=1)
+        self.neighbor_distance = np.sqrt(self._sum_over_shared_neighbors(sd))
+        if self.force_norm:
+            # Normalize by number of neighbors
+            self.neighbor_distance = self.neighbor_distance / np.diff(self.shared_ptr)
 
 
     def _calculate_shear_residue(self, neigh_tensor1, neigh_tensor2, **kwargs):
         """Calculate shear strain given a pair of neighborhood tensors"""
-        u1 = neigh_tensor1
-        u2 = neigh_tensor2
+        # Strain is a small difference between nearly equal tensors,
+        # so use double precision to limit cancellation errors
+        u1 = neigh_tensor1.astype(float)
+        u2 = neigh_tensor2.astype(float)
         try:
-            duu = u2 @ u2.T - u1 @ u1.T
-            uu = np.linalg.inv(u1.T @ u1) 
-            C = 0.5 * (uu @ u1.T @ duu @ u1 @ uu)
-            return 0.5 * np.sum(np.diag(C@C) - np.diag(C)**2)
+            # C = 0.5 * uu @ u1.T @ (u2 @ u2.T - u1 @ u1.T) @ u1 @ uu, with uu = inv(u1.T @ u1);
+            # this simplifies to 0.5 * (X @ X.T - I), with X = inv(u1.T @ u1) @ u1.T @ u2,
+            # which only needs one 3x3 linear solve
+            X = np.linalg.solve(u1.T @ u1, u1.T @ u2)
+            C = 0.5 * (X @ X.T - np.eye(3))
+            return 0.5 * np.sum((C * C.T).sum(axis=1) - np.diag(C)**2)
         except Exception as e:
             print(e)
             return np.nan
@@ -506,26 +550,21 @@ class Deformation:
         self.shear = self._calculate_deformation(self._calculate_shear_residue)
 
 
-    def _calculate_strain_residue(self, neigh_tensor1, neigh_tensor2, **kwargs):
-        """Calculate effective strain given a pair of neighborhood tensors"""
-        # Rotate neighbourhood tensor and calculate Euclidean distance
-        nt3 = rotate_points(neigh_tensor2, neigh_tensor1)
-        if not kwargs["force_absolute"]:
+    def calculate_strain(self):
+        """Calculate effective strain"""
+        if not hasattr(self, "rotated_tensor"):
+            self._get_rotated_shared_tensor()
+
+        # Relative change in the vector to each neighbor after rotation
+        es = np.linalg.norm(self.rotated_tensor - self.shared_tensor[0], axis=1)
+        if not self.force_absolute:
             # Divide by length to get strain
-            es = np.sum(np.linalg.norm(nt3 - neigh_tensor1, axis=1) / np.linalg.norm(neigh_tensor1, axis=1))
-        else:
-            es = np.sum(np.linalg.norm(nt3 - neigh_tensor1, axis=1))
+            es = es / np.linalg.norm(self.shared_tensor[0], axis=1)
 
-        if not kwargs["force_nonorm"]:
+        self.strain = self._sum_over_shared_neighbors(es)
+        if not self.force_nonorm:
             # Normalize ES by number of neighbors
-            es /= len(neigh_tensor1)
-
-        return es
-
-
-    def calculate_strain(self):
-        """Calculate effective strain"""
-        self.strain = self._calculate_deformation(self._calculate_strain_residue)
+            self.strain = self.strain / np.diff(self.shared_ptr)
 
 
     def _calculate_non_affine_residue(self, neigh_tensor1, neigh_tensor2, **kwargs):
@@ -20,6 +20,13 @@ def parse_3letter(x):
 
 def parse_pdb_coordinates(path, chain='', model=0, all_atom=False):
     """Parse coordinates, residue indices, sequence, and bfactor/plddt from a PDB file"""
+    # Alpha-carbons can usually be read directly from the ATOM records,
+    # which avoids building the full BioPython structure
+    if not all_atom:
+        data = parse_pdb_alpha_carbon(path, chain, model)
+        if data is not None:
+            return data
+
     parser = PDBParser(QUIET=True)
     chains = list(parser.get_structure('', path)[model])
     coord, idx, seq, bfac = [], [], [], []
@@ -53,6 +60,92 @@ def parse_pdb_coordinates(path, chain='', model=0, all_atom=False):
     return [np.array(x) for x in [coord, idx, seq, bfac]]
 
 
+### Reads fixed-width ATOM records, following the same conventions as PDBParser
+### (model numbering, HETATM exclusion, bfactor defaults).
+### Files with alternate locations, repeated residues, or chains that are
+### split into separate blocks are left to PDBParser (returns None)
+def parse_pdb_alpha_carbon(path, chain='', model=0):
+    """Parse alpha-carbon coordinates, residue indices, sequence, and bfactor/plddt from a PDB file"""
+    coord, idx, seq, bfac = [], [], [], []
+    chains, residues = set(), set()
+    current_chain, current_residue, has_ca = None, None, False
+    current_model, model_open, started = -1, False, False
+
+    with open(path) as f:
+        for line in f:
+            record = line[:6]
+            if record in ['ATOM  ', 'HETATM']:
+                started = True
+                if not model_open:
+                    current_model += 1
+                    model_open = True
+                if current_model < model:
+                    continue
+                elif current_model > model:
+                    break
+
+                try:
+                    ch = line[21]
+                    residue = (record, ch, int(line[22:26].split()[0]), line[26], line[17:20].strip())
+                except (IndexError, ValueError):
+                    return
+
+                # Chains and residues need to be contiguous blocks
+                if ch != current_chain:
+                    if ch in chains:
+                        return
+                    chains.add(ch)
+                    current_chain = ch
+                if residue != current_residue:
+                    if residue[:4] in residues:
+                        return
+                    residues.add(residue[:4])
+                    current_residue, has_ca = residue, False
+
+                # Ignore HETATM entries
+                if (record != 'ATOM  ') or ((ch != chain) and (chain != '')):
+                    continue
+                if line[12:16].strip() != 'CA':
+                    continue
+                if (line[16] != ' ') or has_ca:
+                    return
+                has_ca = True
+
+                try:
+                    xyz = [float(line[i:i+8]) for i in [30, 38, 46]]
+                except ValueError:
+                    return
+                try:
+                    b = float(line[60:66])
+                except ValueError:
+                    b = 0.0
+
+                coord.append(xyz)
+                idx.append(residue[2])
+                seq.append(parse_3letter(residue[4]))
+                bfac.append(b)
+
+            elif record == 'MODEL ':
+                started = True
+                current_model += 1
+                model_open = True
+                chains, current_chain, current_residue = set(), None, None
+                if current_model > model:
+                    break
+
+            elif record == 'ENDMDL':
+                model_open = False
+                chains, current_chain, current_residue = set(), None, None
+
+            elif started and (record in ['END   ', 'CONECT']):
+                break
+
+    if not len(coord):
+        return
+
+    return [np.array(coord, dtype=np.float32), np.array(idx), np.array(seq), np.array(bfac)]
+
+
 
 
 #############################################################
@@ -223,16 +316,9 @@ def match_xyz_indices_to_seqres(seqres, xyz, seq):
 def find_neighbours(seq, xyz, cut=4.3):
     """Find backbone neighbors based on their Alpha-carbon distances"""
     D = np.linalg.norm(xyz[:-1] - xyz[1:], axis=1)
-    seq_clusters = []
-    cluster = seq[0]
-    for s, d in zip(seq[1:], D):
-        if d < cut:
-            cluster = cluster + s
-        else:
-            seq_clusters.append(cluster)
-            cluster = s
-    seq_clusters.append(cluster)
-    return seq_clusters
+    # Split the sequence wherever consecutive alpha-carbons are not neighbors
+    breaks = np.concatenate([[0], np.flatnonzero(~(D < cut)) + 1, [len(seq)]])
+    return [''.join(seq[start:end]) for start, end in zip(breaks[:-1], breaks[1:])]
 
 
 def align_sequences(seqres, seq, seq_clusters=''):
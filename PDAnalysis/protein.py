@@ -1,4 +1,3 @@
-from collections import Counter
 from pathlib import Path
 
 from pathlib import Path
@@ -6,7 +5,7 @@ import numpy as np
 from scipy.spatial.distance import cdist
 
 from .pdb_parser import parse_pdb_coordinates, parse_mmcif_coordinates, load_and_fix_pdb_data
-from .utils import rotate_points
+from .utils import rotate_point_sets, get_neighbor_arrays
 
 
 class Protein:
@@ -48,6 +47,20 @@ class Protein:
     neigh_tensor: list
         list of neighborhood tensors for each residue
 
+    neigh_mask : np.ndarray(seq_len, seq_len)
+        boolean matrix, True where residues are neighbors
+
+    neigh_ptr : np.ndarray(seq_len + 1)
+        offsets of each residue's neighbors in the flat neighbor arrays;
+        neighbors of residue i are stored at [neigh_ptr[i]:neigh_ptr[i+1]]
+
+    neigh_idx_flat : np.ndarray
+        neighbor indices of all residues, concatenated
+
+    neigh_tensor_flat : np.ndarray(n_neighbors, 3)
+        neighborhood tensors of all residues, concatenated;
+        neigh_tensor contains views of this array
+
 
     Methods
     -------
@@ -115,6 +128,10 @@ class Protein:
         self.dist_mat = None
         self.neigh_idx = []
         self.neigh_tensor = []
+        self.neigh_mask = None
+        self.neigh_ptr = None
+        self.neigh_idx_flat = None
+        self.neigh_tensor_flat = None
         self.seq_len = None         # Number of residues
 
         # Load data
@@ -140,18 +157,18 @@ class Protein:
             elif (ext in ['.txt', '.dat']):
                 try:
                     print(f"WARNING! Ambiguity in file format {ext}. Attempting to read coordinates.")
-                    self.coord = np.loadtxt(inp_obj, delimiter=self.delimiter, skip_rows=self.skip_rows)
+                    self.coord = np.loadtxt(inp_obj, dtype=np.float32, delimiter=self.delimiter, skip_rows=self.skip_rows)
                     self.idx = np.arange(len(self.coord))
                 except:
                     raise Exception("Could not read coordinates from input file!")
 
             ### Read nump binary coordinate file
             elif (ext == '.npy'):
-                self.coord = np.load(inp_obj)
+                self.coord = np.load(inp_obj).astype(np.float32)
                 self.idx = np.arange(len(self.coord))
 
         elif isinstance(inp_obj, np.ndarray):
-            self.coord = inp_obj
+            self.coord = np.asarray(inp_obj, dtype=np.float32)
             self.idx = np.arange(len(self.coord))
 
         else:
@@ -184,8 +201,8 @@ class Protein:
         self.coord_raw = data[0]
         self.idx = data[1]
         self.sequence = data[2]
-        self.bfactor = data[3]
-        self.plddt = data[3].copy()
+        self.bfactor = data[3].astype(np.float32)
+        self.plddt = self.bfactor.copy()
 
         # Fill in 'disordered' (high bfactor, low plddt) with NaN values
         self._update_nan_coords()
@@ -196,10 +213,10 @@ class Protein:
         """Constructs a coordinate array that includes nan values for
         missing residues and for residues excluded based on bfactor/pLDDT"""
 
-        self.coord = np.zeros((len(self.sequence), 3)) * np.nan
+        self.coord = np.zeros((len(self.sequence), 3), np.float32) * np.nan
         self.coord[self.idx] = self.coord_raw.copy()
 
-        bfactor = np.zeros(len(self.sequence)) * np.nan
+        bfactor = np.zeros(len(self.sequence), np.float32) * np.nan
         bfactor[self.idx] = self.bfactor.copy()
         self.bfactor = bfactor
 
@@ -212,22 +229,32 @@ class Protein:
 
     def _get_dist_mat(self):
         """Calculates alpha-carbon distance matrix"""
-        self.dist_mat = cdist(self.coord, self.coord)
+        # cdist always works in double precision; store the result in float32
+        self.dist_mat = cdist(self.coord, self.coord).astype(np.float32)
     
 
     def get_local_neighborhood(self):
         """Extracts local neighborhoods for each residue"""
         if not isinstance(self.dist_mat, np.ndarray):
             self._get_dist_mat()
-        self.neigh_idx = [np.where((d > 0) & (d <= self.neigh_cut) & (np.isfinite(d)))[0] for d in self.dist_mat]
+        # Neighbors are within the cutoff, excluding the residue itself;
+        # comparisons with NaN are always False, so missing residues are excluded
+        self.neigh_mask = (self.dist_mat > 0) & (self.dist_mat <= self.neigh_cut)
+
+        # Neighbors are stored as flat arrays with offsets for each residue
+        self.neigh_ptr, self.neigh_idx_flat, self.neigh_idx = get_neighbor_arrays(self.neigh_mask)
         self._calculate_neighbor_tensor()
 
 
     def _calculate_neighbor_tensor(self):
         """Calculates the neighborhood tensor for each residue"""
-        self.neigh_tensor = []
-        for i, idx in enumerate(self.neigh_idx):
-            self.neigh_tensor.append(self.coord[idx] - self.coord[[i]])
+        # Calculate the displacement vectors for all (residue, neighbor) pairs
+        # in a single pass
+        rows = np.repeat(np.arange(len(self.neigh_ptr) - 1), np.diff(self.neigh_ptr))
+        self.neigh_tensor_flat = self.coord[self.neigh_idx_flat] - self.coord[rows]
+
+        # Split into one tensor per residue
+        self.neigh_tensor = np.split(self.neigh_tensor_flat, self.neigh_ptr[1:-1])
 
 
 
@@ -270,6 +297,20 @@ class AverageProtein:
     neigh_tensor: list
         list of average neighborhood tensors for each residue
 
+    neigh_mask : np.ndarray(seq_len, seq_len)
+        boolean matrix, True where residues are neighbors
+
+    neigh_ptr : np.ndarray(seq_len + 1)
+        offsets of each residue's neighbors in the flat neighbor arrays;
+        neighbors of residue i are stored at [neigh_ptr[i]:neigh_ptr[i+1]]
+
+    neigh_idx_flat : np.ndarray
+        neighbor indices of all residues, concatenated
+
+    neigh_tensor_flat : np.ndarray(n_neighbors, 3)
+        average neighborhood tensors of all residues, concatenated;
+        neigh_tensor contains views of this array
+
 
     Methods
     -------
@@ -356,6 +397,10 @@ class AverageProtein:
         self.dist_mat = None
         self.neigh_idx = []
         self.neigh_tensor = []
+        self.neigh_mask = None
+        self.neigh_ptr = None
+        self.neigh_idx_flat = None
+        self.neigh_tensor_flat = None
         self.seq_len = None         # Number of residues
         self.num_repeat = None      # Number of structures
 
@@ -413,7 +458,11 @@ class AverageProtein:
 
         # Set Distance Matrix
         if self.average_dist_mat:
-            self.dist_mat = np.mean([protein.dist_mat for protein in self.proteins], axis=0)
+            # Add up one matrix at a time, rather than stacking all of them
+            self.dist_mat = self.proteins[0].dist_mat.copy()
+            for protein in self.proteins[1:]:
+                self.dist_mat += protein.dist_mat
+            self.dist_mat /= len(self.proteins)
         else:
             self.dist_mat = self.proteins[0].dist_mat.copy()
 
@@ -448,12 +497,9 @@ class AverageProtein:
 
     def _consolidate_neighbor_lists(self):
         """Exclude neighbors that are not present in all Protein objects"""
-        self.neigh_idx = []
-        for i in range(self.seq_len):
-            # Count how many times indices are included in neighbor lists
-            idx_count = Counter(j for protein in self.proteins for j in protein.neigh_idx[i])
-            # Only include indices that are in all neighbor lists
-            self.neigh_idx.append([j for j, count in idx_count.items() if count == self.num_repeat])
+        # Only include indices that are neighbors in all structures
+        self.neigh_mask = np.logical_and.reduce([protein.neigh_mask for protein in self.proteins])
+        self.neigh_ptr, self.neigh_idx_flat, self.neigh_idx = get_neighbor_arrays(self.neigh_mask)
 
 
     ### For each residue j, rotate all neighbourhoods to match the first one,
@@ -461,32 +507,34 @@ class AverageProtein:
     def _rotate_and_average_neighbor_tensors(self):
         """Align neighborhood tensors by rotating to match the
            neighborhood tensor of the first Protein object."""
-        self.neigh_tensor = []
-        for i in range(self.seq_len):
-            # If no neighbors..
-            if not len(self.neigh_idx[i]):
-                self.neigh_tensor.append(np.empty((0,3)))
-                continue
+        # Residues with neighbors; their neighborhoods are stored
+        # as consecutive blocks of rows
+        start = self.neigh_ptr[np.flatnonzero(np.diff(self.neigh_ptr))]
+
+        # Structures are processed one at a time, adding to a running sum
+        for j, protein in enumerate(self.proteins):
+            # Only include the rows of the tensor that correspond to
+            # the consolidated neighbor list; since neighbors are stored in the
+            # same order as the mask, their positions can be read off the mask
+            tensor = protein.neigh_tensor_flat[np.flatnonzero(self.neigh_mask[protein.neigh_mask])]
 
-            for j in range(self.num_repeat):
-                # Only include the rows of the tensor that correspond to
-                # the consolidated neighbor list
-                idx = [i0 for i0, j0 in enumerate(self.proteins[j].neigh_idx[i]) if j0 in self.neigh_idx[i]]
+            if not j:
+                # Do not rotate the first (reference) tensor
+                reference = tensor
+                total = tensor.copy()
 
-                if not j:
-                    # Do not rotate the first example for residue j
-                    # Initialize the list
-                    tensor = [self.proteins[j].neigh_tensor[i][idx]]
+            elif len(start):
+                # Rotate the neighborhoods of all residues so that they
+                # match the reference neighborhoods
+                total += rotate_point_sets(tensor, reference, start)
 
-                else:
-                    # Rotate tensor so that it matches the first (reference) tensor
-                    rotated_tensor = rotate_points(self.proteins[j].neigh_tensor[i][idx], tensor[0])
-                    tensor.append(rotated_tensor)
-            self.neigh_tensor.append(np.array(tensor).mean(axis=0))
+        self.neigh_tensor_flat = total / self.num_repeat
+        self.neigh_tensor = np.split(self.neigh_tensor_flat, self.neigh_ptr[1:-1])
 
 
     def recalculate_average_structure(self):
         """Recalculate average structure after changing parameters""" 
+        any_changed = False
         for protein in self.proteins:
             changed = np.zeros(3, bool)
             for i, attr in enumerate(['min_plddt', 'max_bfactor', 'neigh_cut']):
@@ -495,9 +543,10 @@ class AverageProtein:
                     setattr(protein, attr, new)
                     changed[i] = True
 
-            # If nothing has changed, exit function
+            # If nothing has changed, skip this protein
             if np.all(changed == False):
-                return
+                continue
+            any_changed = True
 
             # If "min_plddt" or "max_bfactor" have changed,
             # recalculate the coords as NaN values may be different
@@ -508,6 +557,10 @@ class AverageProtein:
             # Recalculate neighborhoods with updated neighbor cutoff
             protein.get_local_neighborhood()
 
+        # If nothing has changed, exit function
+        if not any_changed:
+            return
+
         self._consolidate_neighbor_lists()
         self._rotate_and_average_neighbor_tensors()
 
@@ -1,28 +1,59 @@
 import numpy as np
 
+### "H" is the covariance matrix, P.T @ Q, of the points "P" to be mapped to "Q"
+### Stacks of matrices, shape (N, 3, 3), are processed as a single batch
+def get_rotation_matrix(H):
+    """Gets the optimal rotation matrix using the Kabsch algorithm"""
+    U, S, Vt = np.linalg.svd(H)
+    # Correct for reflections by flipping the sign of the last singular vector,
+    # which is equivalent to R = V @ diag(1, 1, D) @ U.T
+    D = np.sign(np.linalg.det(U) * np.linalg.det(Vt))
+    Vt[...,-1,:] *= D[...,None]
+    return np.swapaxes(U @ Vt, -1, -2)
+
+
 ### "P" is the set of points to be mapped to "Q"
+### Stacks of point sets, shape (N, k, 3), are rotated as a single batch
 def rotate_points(P, Q):
     """Rotates a set of of points using the Kabsch algorithm"""
-    H = P.T @ Q
-    U, S, Vt = np.linalg.svd(H)
-    V = Vt.T
-    D = np.linalg.det(V @ U.T)
-    E = np.array([[1, 0, 0], [0, 1, 0], [0, 0, D]])
-    R = V @ E @ U.T
-    Pnew = (R @ P.T).T
+    R = get_rotation_matrix(np.swapaxes(P, -1, -2) @ Q)
+    Pnew = P @ np.swapaxes(R, -1, -2)
     return Pnew
 
 
+### "P" and "Q" contain many sets of points of different sizes, concatenated;
+### each set is a block of rows, and "start" contains the first row of each set
+def rotate_point_sets(P, Q, start):
+    """Rotates many sets of points at once using the Kabsch algorithm"""
+    H = np.add.reduceat(P[:,:,None] * Q[:,None,:], start)
+    R = get_rotation_matrix(H)
+    count = np.diff(np.append(start, len(P)))
+    return np.einsum('nij,nj->ni', np.repeat(R, count, axis=0), P)
+
+
 ### Returns a np.ndarray of positions where two sequences differ
 def get_mutation_position(s1, s2):
     """Get the position of mutations between two sequences"""
     return np.where(np.array(list(s1)) != np.array(list(s2)))[0]
 
 
+### "mask" is a boolean matrix, True where residues are neighbors;
+### returns offsets "ptr" such that the neighbors of residue i are
+### stored at [ptr[i]:ptr[i+1]] in the flat array of neighbor indices
+def get_neighbor_arrays(mask):
+    """Get flat neighbor arrays from a boolean neighbor matrix"""
+    # Neighbor indices are returned in row order
+    rows, cols = np.nonzero(mask)
+    count = np.bincount(rows, minlength=len(mask))
+    ptr = np.concatenate([[0], np.cumsum(count)])
+    return ptr, cols, np.split(cols, ptr[1:-1])
+
+
 def get_shared_indices(idx1, idx2):
     """Get the intersection between two sets of indices"""
-    i1 = np.where(np.in1d(idx1, idx2))[0]
-    i2 = np.where(np.in1d(idx2, idx1))[0]
+    # Neighbor indices are unique, so a single sort-based intersection
+    # gives the positions of shared indices in both arrays
+    _, i1, i2 = np.intersect1d(idx1, idx2, assume_unique=True, return_indices=True)
     return i1, i2
 
 